@@ -1,9 +1,10 @@
+from math import hypot
+
 calib_store = {}
 
 def compute_mpp(p1, p2, lane_width_m):
-    dx = p2[0] - p1[0]
-    dy = p2[1] - p1[1]
-    dist = (dx*dx + dy*dy)**0.5
+    # hypot is one C call, no Python pow dispatch for the square root
+    dist = hypot(p2[0] - p1[0], p2[1] - p1[1])
     return lane_width_m / dist
 
 def save_calibration(video_id, mpp, fps):
@@ -15,3 +15,6 @@ os.makedirs(RUNS_DIR, exist_ok=True)
 # (Optional) Data dir for plate owner CSV
 DATA_DIR = os.path.join(PROJECT_ROOT, "data")
 os.makedirs(DATA_DIR, exist_ok=True)
+
+# CSV database mapping plates to owners
+PLATE_DB_PATH = os.path.join(DATA_DIR, "plate_owners.csv")
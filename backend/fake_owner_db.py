@@ -1,15 +1,31 @@
 import csv
+import os
 from .config import PLATE_DB_PATH
 
-def lookup_owner(plate):
-    plate = (plate or "").replace(" ", "").upper()
+# plate -> row, parsed from the CSV once and reloaded only when the file's
+# mtime changes. Shared with utils.lookup_owner so there is a single cache.
+_BY_PLATE = None
+_DB_MTIME = None
 
+
+def _load_index():
+    global _BY_PLATE, _DB_MTIME
     try:
-        with open(PLATE_DB_PATH) as f:
-            for row in csv.DictReader(f):
-                if row["plate"].upper() == plate:
-                    return row
-    except FileNotFoundError:
-        return None
-
-    return None
+        mtime = os.path.getmtime(PLATE_DB_PATH)
+    except OSError:
+        _BY_PLATE, _DB_MTIME = {}, None
+        return _BY_PLATE
+
+    if _BY_PLATE is None or mtime != _DB_MTIME:
+        with open(PLATE_DB_PATH, newline="") as f:
+            _BY_PLATE = {
+                row["plate"].replace(" ", "").upper(): row
+                for row in csv.DictReader(f)
+            }
+        _DB_MTIME = mtime
+    return _BY_PLATE
+
+
+def lookup_owner(plate):
+    plate = (plate or "").replace(" ", "").upper()
+    return _load_index().get(plate)
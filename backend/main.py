@@ -2,11 +2,21 @@
 
 import os
 import shutil
+import time
 import uuid
 from pathlib import Path
 
-from fastapi import FastAPI, UploadFile, File
+from fastapi import FastAPI, UploadFile, File, Request, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse
+
+# orjson serializes the big per-track result lists several times faster
+# than stdlib json; fall back cleanly if it isn't installed.
+try:
+    import orjson  # noqa: F401
+    from fastapi.responses import ORJSONResponse as DefaultResponse
+except ImportError:
+    from fastapi.responses import JSONResponse as DefaultResponse
 
 # ✅ Adjust these imports to match your existing files
 import speed  # your speed processing module
@@ -18,11 +28,14 @@ import speed  # your speed processing module
 BASE_DIR = Path(__file__).resolve().parent
 UPLOAD_DIR = BASE_DIR / "uploads"
 UPLOAD_DIR.mkdir(exist_ok=True)
+ANNOTATED_DIR = BASE_DIR / "annotated"
+ANNOTATED_DIR.mkdir(exist_ok=True)
 
 app = FastAPI(
     title="SpeedCam Backend",
     description="YOLO + tracking speed estimation backend for the Streamlit frontend.",
     version="1.0.0",
+    default_response_class=DefaultResponse,
 )
 
 # === CORS so Streamlit Cloud / localhost can talk to this ===
@@ -35,6 +48,14 @@ app.add_middleware(
 )
 
 
+@app.on_event("startup")
+def warmup_model():
+    # Pin thread pools before any inference runs, then load and warm the
+    # YOLO model once so the first upload isn't slow.
+    speed.configure_threads()
+    speed.warmup()
+
+
 @app.get("/")
 def root():
     return {
@@ -43,50 +64,205 @@ def root():
     }
 
 
-@app.post("/analyze_video")
-async def analyze_video(file: UploadFile = File(...)):
-    """
-    Receive an uploaded video, save to temp, run the speed pipeline,
-    and return JSON results.
-    """
+# In-memory job store: job_id -> {status, pct, partial, result, created}.
+# Fine for this single-process backend; swap for Redis if it's ever scaled
+# out to multiple workers.
+jobs = {}
+JOB_TTL_S = 3600
+
+
+def _prune_jobs():
+    cutoff = time.time() - JOB_TTL_S
+    # Only finished jobs age out, and from their completion time: analyses
+    # are serialized behind speed._analysis_lock, so a job can legitimately
+    # still be queued or running an hour after submission and must not be
+    # evicted from under its worker and its polling client.
+    stale = [
+        j for j, info in jobs.items()
+        if info["status"] in ("done", "error")
+        and info.get("finished", info["created"]) < cutoff
+    ]
+    for job_id in stale:
+        jobs.pop(job_id, None)
+    # Annotated videos and abandoned chunked uploads (a .part never
+    # finalized because the client went away mid-upload) age out on the
+    # same schedule; without this, annotated/ and uploads/ grow without
+    # bound.
+    for pattern, directory in (("*.mp4", ANNOTATED_DIR), ("*.part", UPLOAD_DIR)):
+        for path in directory.glob(pattern):
+            try:
+                if path.stat().st_mtime < cutoff:
+                    path.unlink()
+            except OSError:
+                pass  # already gone, or mid-write
+
+
+def _new_job() -> str:
+    _prune_jobs()
+    job_id = uuid.uuid4().hex
+    jobs[job_id] = {
+        "status": "queued",
+        "pct": 0.0,
+        "partial": None,
+        "result": None,
+        "created": time.time(),
+    }
+    return job_id
 
-    # 1) Save upload to a temporary file
-    ext = Path(file.filename).suffix or ".mp4"
-    tmp_name = f"{uuid.uuid4().hex}{ext}"
-    tmp_path = UPLOAD_DIR / tmp_name
 
-    with tmp_path.open("wb") as f:
-        shutil.copyfileobj(file.file, f)
+def _run_job(job_id: str, tmp_path: Path):
+    """Background worker for one analysis job; updates the job record
+    with progress as the video streams through the pipeline."""
+    job = jobs[job_id]
+    job["status"] = "running"
+
+    def _progress(done, total, partial):
+        if total:
+            job["pct"] = round(100.0 * done / total, 1)
+        job["partial"] = partial
+
+    payload = _run_pipeline(tmp_path, progress_cb=_progress)
+    job["result"] = payload
+    job["finished"] = time.time()
+    if payload.get("status") == "ok":
+        job["status"] = "done"
+        job["pct"] = 100.0
+    else:
+        job["status"] = "error"
+
+
+def _run_pipeline(tmp_path: Path, progress_cb=None):
+    """
+    Run the speed pipeline on a saved upload, clean the temp file up,
+    and return the JSON payload. Shared by the one-shot and chunked
+    upload endpoints.
+    """
+    annotated_name = f"{uuid.uuid4().hex}.mp4"
+    annotated_path = ANNOTATED_DIR / annotated_name
 
-    # 2) Run your existing speed pipeline
-    #    🔴 IMPORTANT: change `run_speed_estimation` to whatever function
-    #    you already use that takes a video path and returns a dict.
-    #    For example, if you had speed.process_video(tmp_path) use that instead.
     try:
-        result = speed.run_speed_estimation(str(tmp_path))
-        # expected shape (example):
-        # {
-        #   "summary": {...},
-        #   "overspeed_events": [...],
-        #   "within_limit": [...]
-        # }
+        result = speed.run_speed_estimation(
+            str(tmp_path),
+            annotated_path=str(annotated_path),
+            progress_cb=progress_cb,
+        )
+        # The annotated video stays on disk and is served by /annotated/{name};
+        # returning a URL keeps the JSON response small instead of inlining
+        # the whole mp4 as base64.
+        if annotated_path.exists():
+            result["annotated_video_url"] = f"/annotated/{annotated_name}"
     except Exception as e:
-        # Clean up before raising
+        # Clean up the upload and any partial annotated output
         if tmp_path.exists():
             tmp_path.unlink()
+        annotated_path.unlink(missing_ok=True)
         return {"status": "error", "detail": str(e)}
 
-    # 3) Clean up temporary file
+    # Clean up temporary file
     if tmp_path.exists():
         tmp_path.unlink()
 
-    # 4) Return JSON
     return {
         "status": "ok",
         "data": result,
     }
 
 
+@app.post("/analyze_video")
+async def analyze_video(background_tasks: BackgroundTasks, file: UploadFile = File(...)):
+    """
+    Receive an uploaded video, save to temp, and start the speed pipeline
+    in the background. Returns a job_id immediately; poll
+    GET /analyze_video/{job_id} for progress and the final result.
+    """
+
+    # Save upload to a temporary file in 1 MB chunks (copyfileobj's
+    # default buffer is 64 KB – needlessly many syscalls for video-sized
+    # bodies), and never leave a partial file behind if the copy dies.
+    ext = Path(file.filename).suffix or ".mp4"
+    tmp_name = f"{uuid.uuid4().hex}{ext}"
+    tmp_path = UPLOAD_DIR / tmp_name
+
+    try:
+        with tmp_path.open("wb") as f:
+            shutil.copyfileobj(file.file, f, length=1 << 20)
+    except Exception:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+    job_id = _new_job()
+    background_tasks.add_task(_run_job, job_id, tmp_path)
+    return {"status": "ok", "job_id": job_id}
+
+
+@app.get("/analyze_video/{job_id}")
+def analyze_video_status(job_id: str):
+    """
+    Poll a running analysis job: status (queued/running/done/error),
+    percent done, partial stats while running, and the full result once
+    finished.
+    """
+    job = jobs.get(job_id)
+    if job is None:
+        return {"status": "error", "detail": f"Unknown job_id: {job_id}"}
+
+    payload = {"status": job["status"], "pct": job["pct"], "partial": job["partial"]}
+    if job["status"] in ("done", "error"):
+        payload["result"] = job["result"]
+    return payload
+
+
+@app.put("/upload/{upload_id}/{offset}")
+async def upload_chunk(upload_id: str, offset: int, request: Request):
+    """
+    Receive one chunk of a client-side chunked upload. Chunks carry
+    their byte offset, so a failed chunk can simply be retried without
+    restarting the whole upload.
+    """
+    part_path = UPLOAD_DIR / f"{Path(upload_id).name}.part"
+    body = await request.body()
+
+    mode = "r+b" if part_path.exists() else "wb"
+    with part_path.open(mode) as f:
+        f.seek(offset)
+        f.write(body)
+
+    return {"status": "ok", "received": len(body)}
+
+
+@app.post("/analyze_video/finalize")
+def finalize_upload(payload: dict, background_tasks: BackgroundTasks):
+    """
+    Assemble a chunked upload and start the speed pipeline on it in the
+    background. Expects {"upload_id": ..., "filename": ...}; returns a
+    job_id for GET /analyze_video/{job_id}.
+    """
+    upload_id = Path(str(payload.get("upload_id", ""))).name
+    part_path = UPLOAD_DIR / f"{upload_id}.part"
+    if not upload_id or not part_path.exists():
+        return {"status": "error", "detail": f"Unknown upload_id: {upload_id}"}
+
+    ext = Path(payload.get("filename") or "").suffix or ".mp4"
+    tmp_path = UPLOAD_DIR / f"{upload_id}{ext}"
+    part_path.rename(tmp_path)
+
+    job_id = _new_job()
+    background_tasks.add_task(_run_job, job_id, tmp_path)
+    return {"status": "ok", "job_id": job_id}
+
+
+@app.get("/annotated/{name}")
+def get_annotated_video(name: str):
+    """
+    Stream an annotated result video produced by /analyze_video.
+    The file is sent straight from disk, never loaded into memory.
+    """
+    path = ANNOTATED_DIR / Path(name).name  # strip any path components
+    if not path.exists():
+        return {"status": "error", "detail": f"No annotated video named {name}"}
+    return FileResponse(path, media_type="video/mp4")
+
+
 # Optional: endpoint to just check health
 @app.get("/health")
 def health():
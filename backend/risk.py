@@ -1,7 +1,6 @@
-def classify_speed(kmh, limit):
-    if kmh <= limit:
-        return "within_limit"
-    elif kmh <= limit + 5:
-        return "grace"
-    else:
-        return "overspeed"
+_STATUS = ("within_limit", "grace", "overspeed")
+
+def classify_speed(kmh, limit, grace=5.0):
+    # Branchless: the two comparisons become 0/1 and index the tuple,
+    # so there is no if/elif dispatch in per-track hot paths.
+    return _STATUS[(kmh > limit) + (kmh > limit + grace)]
@@ -1,16 +1,110 @@
 # backend/speed.py
 
+import os
+
+# Cap BLAS/OMP fan-out before numpy/torch load their thread pools.
+# Decode, inference, and postprocess otherwise each spawn num_cpus
+# threads in the same process and oversubscribe the box.
+_N_THREADS = str(max(1, (os.cpu_count() or 2) - 1))
+os.environ.setdefault("OMP_NUM_THREADS", _N_THREADS)
+os.environ.setdefault("OPENBLAS_NUM_THREADS", "1")
+os.environ.setdefault("MKL_NUM_THREADS", "1")
+
+import base64
+import functools
+import queue
+import threading
 import cv2
 import numpy as np
+from dataclasses import dataclass
 from ultralytics import YOLO
 from pathlib import Path
 from typing import Dict, Any, List
 
+# speed.py is imported both flat (main.py) and as part of the backend package
+try:
+    from .risk import classify_speed
+except ImportError:
+    from risk import classify_speed
+
+# Set SPEEDCAM_USE_ONNX=0 to force plain PyTorch inference (e.g. while debugging exports).
+USE_ONNX = os.getenv("SPEEDCAM_USE_ONNX", "1") == "1"
 
+# Ask OpenCV's FFmpeg backend for hardware-accelerated decode
+# (VAAPI/NVDEC/VideoToolbox, whatever the platform offers); FFmpeg falls
+# back to software decoding when none is available. The variable is read
+# at VideoCapture-open time, so this also covers the capture ultralytics
+# opens internally for model.track. Export it yourself to override.
+os.environ.setdefault("OPENCV_FFMPEG_CAPTURE_OPTIONS", "hwaccel;auto")
+
+
+def _quantize_onnx(onnx_path: Path, int8_path: Path) -> bool:
+    """
+    Quantize an exported ONNX model to INT8 weights (dynamic quantization,
+    no calibration data needed). Returns True on success; failure is non-fatal.
+    """
+    try:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        quantize_dynamic(str(onnx_path), str(int8_path), weight_type=QuantType.QUInt8)
+        return True
+    except Exception as e:
+        print(f"[WARN] ONNX INT8 quantization failed: {e}")
+        return False
+
+
+def prepare_model_path(pt_path: str) -> str:
+    """
+    Return the fastest available weights file for a given .pt checkpoint.
+
+    Preference order:
+    1. <stem>_int8.onnx  – INT8-quantized ONNX, run via ONNX Runtime (~2x CPU throughput)
+    2. <stem>.onnx       – FP32/FP16 ONNX export
+    3. the original .pt  – PyTorch fallback
+
+    Export + quantization happen once and the files are cached next to the
+    checkpoint; any failure falls back to the .pt file.
+    """
+    if not USE_ONNX:
+        return pt_path
+
+    pt = Path(pt_path)
+    onnx_path = pt.with_suffix(".onnx")
+    int8_path = pt.with_name(pt.stem + "_int8.onnx")
+
+    if int8_path.exists():
+        return str(int8_path)
+
+    if not onnx_path.exists():
+        if not pt.exists():
+            # Nothing local to export from – let ultralytics handle the .pt.
+            return pt_path
+        try:
+            YOLO(str(pt)).export(format="onnx", imgsz=640, dynamic=False)
+        except Exception as e:
+            print(f"[WARN] ONNX export failed, using PyTorch weights: {e}")
+            return pt_path
+
+    if onnx_path.exists():
+        if _quantize_onnx(onnx_path, int8_path):
+            return str(int8_path)
+        return str(onnx_path)
+    return pt_path
+
+
+@functools.lru_cache(maxsize=2)
 def load_detector(model_dir: str = "models") -> YOLO:
     """
     Load YOLO model for vehicle detection.
     Tries car_detector_fast.pt first, then falls back to yolov8n.pt.
+    Local checkpoints are exported to quantized ONNX once and then served
+    through ONNX Runtime instead of FP32 PyTorch.
+
+    Cached per model_dir so the weights are loaded once per process and
+    reused across requests. The model is NOT read-only in use –
+    model.track(persist=True) installs a predictor and keeps ByteTrack
+    state on it between calls – so run_speed_estimation serializes
+    analyses behind _analysis_lock and resets tracker state per video.
     """
     model_path = None
 
@@ -27,15 +121,90 @@ def load_detector(model_dir: str = "models") -> YOLO:
             # Let ultralytics download the default yolov8n if nothing found
             model_path = "yolov8n.pt"
 
-    model = YOLO(model_path)
+    # ONNX models carry no task metadata, so be explicit about detection.
+    model = YOLO(prepare_model_path(model_path), task="detect")
     return model
 
 
+# model.track(persist=True) mutates the cached model: it installs a
+# predictor and carries ByteTrack state on it across calls. Concurrent
+# background jobs sharing load_detector()'s model would interleave and
+# corrupt each other's predictor/tracker state, so analyses run one at a
+# time per process.
+_analysis_lock = threading.Lock()
+
+
+@dataclass(slots=True)
+class Track:
+    """
+    Per-vehicle tracking state. Slotted because thousands of tracks can
+    accumulate over a long video: slots drop the per-instance __dict__
+    (several hundred bytes each) and make attribute access faster.
+    """
+    class_id: int
+    last_y: float
+    last_frame: int
+    max_speed_kmh: float = 0.0
+
+
+def _open_writer(path: str, fps: float, size) -> cv2.VideoWriter:
+    """
+    Open a VideoWriter, preferring H.264 (avc1) – hardware-backed where
+    OpenCV's FFmpeg build supports it, and much faster/smaller than mp4v
+    either way – falling back to software mp4v when the codec is missing.
+    """
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"avc1"), fps, size)
+    if not writer.isOpened():
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, size)
+    return writer
+
+
+@functools.lru_cache(maxsize=32)
+def _video_fps(video_path: str) -> float:
+    """
+    Probe a video's FPS with OpenCV. Cached per path so repeated analyses
+    of the same file don't pay the open/codec-init cycle again.
+    """
+    cap = cv2.VideoCapture(video_path)
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    cap.release()
+    return fps if fps > 0 else 30.0  # safe default
+
+
+def configure_threads() -> None:
+    """
+    Pin library thread pools so video decode and model inference don't
+    oversubscribe the CPU: OpenCV sticks to one thread, torch gets the
+    remaining cores, and torch interop stays at 1.
+    """
+    cv2.setNumThreads(1)
+    try:
+        import torch
+
+        torch.set_num_threads(int(os.environ["OMP_NUM_THREADS"]))
+        torch.set_num_interop_threads(1)
+    except Exception as e:
+        # Not fatal – torch may be absent (pure ONNX install) or already warmed up
+        print(f"[WARN] Could not set torch thread counts: {e}")
+
+
+def warmup() -> None:
+    """
+    Load the detector and run one dummy inference so the first real
+    request doesn't pay for weight loading and kernel warmup.
+    """
+    model = load_detector()
+    model.predict(np.zeros((640, 640, 3), dtype=np.uint8), verbose=False)
+
+
 def run_speed_estimation(
     video_path: str,
     speed_limit_kmh: float = 60.0,
     grace_kmh: float = 5.0,
     px_to_m_factor: float = 0.05,
+    annotated_path: str = None,
+    max_preview_frames: int = 5,
+    progress_cb=None,
 ) -> Dict[str, Any]:
     """
     Estimate vehicle speeds from a video using YOLO tracking.
@@ -44,91 +213,255 @@ def run_speed_estimation(
     - Camera is roughly fixed.
     - Vertical movement in pixels ~ distance along the road.
     - px_to_m_factor: meters per pixel (tuned by calibration).
+
+    When annotated_path is set, an annotated copy of the video (box +
+    current speed per track) is written there, and up to
+    max_preview_frames annotated thumbnails are returned as base64 JPEGs.
+    Boxes are drawn in-place on the decoded frame – nothing downstream
+    reuses those pixels, so there is no per-frame copy – and drawing plus
+    encoding run on a background thread behind a small bounded queue, so
+    they overlap with decode + inference instead of serializing with
+    them. When annotated_path is None (the default) the whole path is
+    skipped.
+
+    progress_cb, if given, is called every ~30 frames with
+    (frames_done, total_frames_or_None, partial_stats_dict) so callers
+    can report progress while the video is still being analyzed.
     """
 
     video_path = str(video_path)
-    cap = cv2.VideoCapture(video_path)
-    if not cap.isOpened():
-        raise RuntimeError(f"Could not open video: {video_path}")
+    model = load_detector()
 
-    fps = cap.get(cv2.CAP_PROP_FPS)
-    cap.release()
-    if fps <= 0:
-        fps = 30.0  # safe default
+    # Total frame count, for progress reporting only
+    total_frames = None
 
-    model = load_detector()
+    # Filled in lazily from the tracking dataloader's metadata – opening
+    # the video a second time just to read FPS would duplicate codec init.
+    fps = None
 
-    # track_id -> info
-    tracks: Dict[int, Dict[str, Any]] = {}
+    # track_id -> Track, active tracks only. Tracks not seen for more than
+    # max_track_age frames move to `archived` so the working set stays
+    # bounded on long videos instead of growing with every vehicle ever seen.
+    max_track_age = 60
+    tracks: Dict[int, Track] = {}
+    archived: Dict[int, Track] = {}
     frame_idx = 0
 
     # Classes for vehicles in COCO: car=2, bus=5, truck=7, motorcycle=3
-    vehicle_classes = {2, 3, 5, 7}
-
-    # Use YOLO tracking in streaming mode
-    for result in model.track(
-        source=video_path,
-        stream=True,
-        verbose=False,
-        persist=True,
-    ):
-        frame_idx += 1
-
-        if result.boxes is None or result.boxes.id is None:
-            continue
-
-        ids = result.boxes.id.cpu().numpy().astype(int)
-        xyxy = result.boxes.xyxy.cpu().numpy()
-        clses = result.boxes.cls.cpu().numpy().astype(int)
-
-        for tid, box, cls_id in zip(ids, xyxy, clses):
-            if cls_id not in vehicle_classes:
-                continue
-
-            x1, y1, x2, y2 = box.tolist()
-            cy = (y1 + y2) / 2.0  # vertical center
-
-            info = tracks.get(tid, {
-                "last_y": cy,
-                "last_frame": frame_idx,
-                "max_speed_kmh": 0.0,
-                "class_id": int(cls_id),
-            })
-
-            # compute speed from movement between frames
-            prev_frame = info["last_frame"]
-            prev_y = info["last_y"]
-            dt_frames = frame_idx - prev_frame
-
-            if dt_frames > 0:
-                dt_s = dt_frames / fps
-                dy_px = abs(cy - prev_y)
-                dist_m = dy_px * px_to_m_factor
-                speed_m_s = dist_m / dt_s if dt_s > 0 else 0.0
-                speed_kmh = speed_m_s * 3.6
-                if speed_kmh > info["max_speed_kmh"]:
-                    info["max_speed_kmh"] = speed_kmh
-
-            info["last_y"] = cy
-            info["last_frame"] = frame_idx
-            tracks[tid] = info
+    vehicle_classes = np.array([2, 3, 5, 7], dtype=np.int32)
+
+    preview_frames_b64: List[str] = []
+    last_preview_idx = -10 ** 9
+
+    # Annotation pipeline: the main thread only decides what to draw and
+    # enqueues (frame, items, take_preview); this worker does the actual
+    # drawing, JPEG preview encode, and video encode. The bounded queue
+    # gives backpressure so at most 4 frames are in flight.
+    annot_queue = None
+    annot_thread = None
+
+    def _annotate_worker():
+        writer = None
+        while True:
+            item = annot_queue.get()
+            if item is None:
+                break
+            frame, draw_items, take_preview = item
+
+            if writer is None:
+                h, w = frame.shape[:2]
+                writer = _open_writer(annotated_path, fps, (w, h))
+
+            for x1, y1, x2, y2, label in draw_items:
+                cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
+                if label is not None:
+                    cv2.putText(
+                        frame, label, (x1, max(0, y1 - 6)),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 1,
+                    )
+
+            if take_preview:
+                # Previews are shown as thumbnails – downscale and drop
+                # JPEG quality to 70 so each one is a few tens of KB
+                # instead of a full-res quality-95 encode.
+                h, w = frame.shape[:2]
+                preview = frame
+                if w > 640:
+                    preview = cv2.resize(
+                        frame, (640, max(1, int(640 * h / w))),
+                        interpolation=cv2.INTER_AREA,
+                    )
+                ok, buf = cv2.imencode(
+                    ".jpg", preview,
+                    [cv2.IMWRITE_JPEG_QUALITY, 70, cv2.IMWRITE_JPEG_OPTIMIZE, 1],
+                )
+                if ok:
+                    preview_frames_b64.append(base64.b64encode(buf).decode("ascii"))
+
+        if writer is not None:
+            writer.release()
+
+    with _analysis_lock:
+        if annotated_path is not None:
+            annot_queue = queue.Queue(maxsize=4)
+            annot_thread = threading.Thread(target=_annotate_worker, daemon=True)
+            annot_thread.start()
+
+        # Start from clean tracker state: persist=True is wanted within a
+        # video but would otherwise bleed the previous video's tracks
+        # into this one.
+        predictor = getattr(model, "predictor", None)
+        for tracker in getattr(predictor, "trackers", None) or []:
+            if hasattr(tracker, "reset"):
+                tracker.reset()
+
+        # Sentinel + join run in the finally so a mid-video decode or
+        # inference error can't leak the worker thread blocked on get()
+        # with an unreleased VideoWriter.
+        try:
+            # Use YOLO tracking in streaming mode
+            for result in model.track(
+                source=video_path,
+                stream=True,
+                verbose=False,
+                persist=True,
+                tracker="bytetrack.yaml",
+            ):
+                frame_idx += 1
+
+                if fps is None:
+                    # ultralytics already has the video open – reuse its metadata
+                    dataset = getattr(model.predictor, "dataset", None)
+                    raw = getattr(dataset, "fps", None)
+                    if isinstance(raw, (list, tuple)) and raw:
+                        raw = raw[0]
+                    fps = float(raw) if raw and raw > 0 else _video_fps(video_path)
+
+                    total_frames = getattr(dataset, "frames", None)
+                    if isinstance(total_frames, (list, tuple)):
+                        total_frames = total_frames[0] if total_frames else None
+
+                if result.boxes is None or result.boxes.id is None:
+                    ids = xyxy = None
+                    mask = None
+                else:
+                    # One host transfer for all box attributes instead of three
+                    # separate .cpu().numpy() pulls and casts.
+                    data = result.boxes.data.cpu().numpy()  # [x1,y1,x2,y2,id,conf,cls]
+                    xyxy = data[:, :4]
+                    ids = data[:, 4].astype(np.int32, copy=False)
+                    clses = data[:, 6].astype(np.int32, copy=False)
+
+                    # Filter vehicle classes and compute vertical centers in one
+                    # vectorized pass instead of per-box Python arithmetic.
+                    mask = np.isin(clses, vehicle_classes)
+
+                # current per-track speed for this frame, used for labels
+                frame_speeds: Dict[int, float] = {}
+
+                if mask is not None and mask.any():
+                    cys = (xyxy[mask, 1] + xyxy[mask, 3]) * 0.5
+
+                    for tid, cls_id, cy in zip(ids[mask], clses[mask], cys):
+                        cy = float(cy)
+
+                        tr = tracks.get(tid)
+                        if tr is None:
+                            # Revive an archived track if the id comes back, else start fresh
+                            tr = archived.pop(tid, None)
+                        if tr is None:
+                            tr = Track(class_id=int(cls_id), last_y=cy, last_frame=frame_idx)
+
+                        # compute speed from movement between frames
+                        dt_frames = frame_idx - tr.last_frame
+
+                        if dt_frames > 0:
+                            dt_s = dt_frames / fps
+                            dy_px = abs(cy - tr.last_y)
+                            dist_m = dy_px * px_to_m_factor
+                            speed_m_s = dist_m / dt_s if dt_s > 0 else 0.0
+                            speed_kmh = speed_m_s * 3.6
+                            if speed_kmh > tr.max_speed_kmh:
+                                tr.max_speed_kmh = speed_kmh
+                            frame_speeds[int(tid)] = speed_kmh
+
+                        tr.last_y = cy
+                        tr.last_frame = frame_idx
+                        tracks[tid] = tr
+
+                # Periodically age out tracks that left the scene long ago
+                if frame_idx % 30 == 0:
+                    stale = [
+                        tid for tid, tr in tracks.items()
+                        if frame_idx - tr.last_frame > max_track_age
+                    ]
+                    for tid in stale:
+                        archived[tid] = tracks.pop(tid)
+
+                    if progress_cb is not None:
+                        progress_cb(frame_idx, total_frames, {
+                            "frames_done": frame_idx,
+                            "total_frames": total_frames,
+                            "num_vehicles": len(tracks) + len(archived),
+                        })
+
+                if annot_queue is not None:
+                    draw_items = []
+                    if mask is not None and mask.any():
+                        # Once the preview quota is filled, the annotated video is
+                        # the only consumer – keep the boxes but skip the speed
+                        # labels, since antialiased glyph rendering is the pricey
+                        # part of drawing.
+                        want_labels = len(preview_frames_b64) < max_preview_frames
+                        for tid, box in zip(ids[mask], xyxy[mask]):
+                            x1, y1, x2, y2 = box.astype(int).tolist()
+                            label = None
+                            if want_labels:
+                                label = f"id {int(tid)} {frame_speeds.get(int(tid), 0.0):.0f} km/h"
+                            draw_items.append((x1, y1, x2, y2, label))
+
+                    # len() can lag the worker by an in-flight frame; the cap is soft
+                    take_preview = bool(
+                        draw_items
+                        and len(preview_frames_b64) < max_preview_frames
+                        and frame_idx - last_preview_idx >= 30
+                    )
+                    if take_preview:
+                        last_preview_idx = frame_idx
+
+                    # orig_img is ours to scribble on – the worker draws in-place.
+                    # put() blocks when the queue is full, giving backpressure.
+                    annot_queue.put((result.orig_img, draw_items, take_preview))
+
+        finally:
+            if annot_thread is not None:
+                annot_queue.put(None)  # sentinel
+                annot_thread.join()
+
+    # Fold still-active tracks back in for the summary
+    tracks = {**archived, **tracks}
 
     # Build result tables
     overspeed_events: List[Dict[str, Any]] = []
     within_limit: List[Dict[str, Any]] = []
 
-    limit_with_grace = speed_limit_kmh + grace_kmh
-
-    for tid, info in tracks.items():
-        max_speed = float(info["max_speed_kmh"])
+    # Single pass: classify and serialize each track once, straight into
+    # the response lists. Plain Python ints/floats only, so the JSON
+    # encoder never has to fall back to slow per-object handling.
+    speeds: List[float] = []
+    for tid, tr in tracks.items():
+        max_speed = float(tr.max_speed_kmh)
+        speeds.append(max_speed)
+        status = classify_speed(max_speed, speed_limit_kmh, grace_kmh)
         row = {
-            "track_id": tid,
-            "vehicle_class": info["class_id"],
+            "track_id": int(tid),
+            "vehicle_class": tr.class_id,
             "max_speed_kmh": round(max_speed, 2),
             "speed_limit_kmh": speed_limit_kmh,
             "grace_kmh": grace_kmh,
+            "status": status,
         }
-        if max_speed > limit_with_grace:
+        if status == "overspeed":
             overspeed_events.append(row)
         else:
             within_limit.append(row)
@@ -139,11 +472,17 @@ def run_speed_estimation(
         "num_within_limit": len(within_limit),
         "speed_limit_kmh": speed_limit_kmh,
         "grace_kmh": grace_kmh,
+        # Computed here once so the frontend never has to re-reduce the
+        # per-track lists on every rerun.
+        "min_speed_kmh": round(min(speeds), 2) if speeds else 0.0,
+        "max_speed_kmh": round(max(speeds), 2) if speeds else 0.0,
+        "avg_speed_kmh": round(sum(speeds) / len(speeds), 2) if speeds else 0.0,
     }
 
     return {
         "summary_stats": summary,
         "overspeed_events": overspeed_events,
         "within_limit": within_limit,
+        "preview_frames_b64": preview_frames_b64,
     }
 
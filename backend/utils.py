@@ -1,18 +1,13 @@
 # backend/utils.py
 
 import os
-import csv
 from typing import Optional, Dict
 
 import smtplib
 import ssl
 from email.message import EmailMessage
 
-# Base directory = project root
-BASE_DIR = os.path.dirname(os.path.dirname(__file__))
-
-# Simple CSV database of plates → owners
-PLATE_DB_PATH = os.path.join(BASE_DIR, "data", "plate_owners.csv")
+from .fake_owner_db import _load_index as _shared_plate_index
 
 # Email config (set these in your terminal or .env if you want real emails)
 SMTP_SERVER = os.getenv("SMTP_SERVER", "smtp.gmail.com")
@@ -27,25 +22,23 @@ def lookup_owner(plate_text: Optional[str]) -> Optional[Dict]:
     CSV format:
         plate,owner,email
         ABC123,John Doe,john@example.com
+
+    Served from the plate index shared with fake_owner_db, which is parsed
+    once and reloaded only when the CSV's mtime changes.
     """
     if not plate_text:
         return None
-    if not os.path.exists(PLATE_DB_PATH):
-        print(f"[WARN] Plate DB not found at {PLATE_DB_PATH}")
+
+    plate = plate_text.replace(" ", "").upper()
+    row = _shared_plate_index().get(plate)
+    if row is None:
         return None
 
-    plate_upper = plate_text.upper().strip()
-
-    with open(PLATE_DB_PATH, newline="") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            if row.get("plate", "").upper().strip() == plate_upper:
-                return {
-                    "plate": plate_upper,
-                    "owner": row.get("owner", ""),
-                    "email": row.get("email", ""),
-                }
-    return None
+    return {
+        "plate": plate,
+        "owner": row.get("owner", ""),
+        "email": row.get("email", ""),
+    }
 
 
 def send_violation_email(track, speed_limit_kmh: float, grace_kmh: float) -> None:
@@ -0,0 +1,320 @@
+# frontend/_common.py
+#
+# HTTP, caching, and conversion helpers shared by the Streamlit app.
+# Kept out of app.py so the script Streamlit re-executes per rerun stays
+# small and the helpers sit behind one import.
+
+import base64
+import hashlib
+import json
+import socket
+import time
+import uuid
+import pyarrow as pa
+import requests
+import streamlit as st
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+from urllib3.util.retry import Retry
+
+try:
+    from requests_toolbelt.multipart.encoder import MultipartEncoder
+except ImportError:  # optional – falls back to a buffered upload
+    MultipartEncoder = None
+
+try:
+    import orjson
+except ImportError:  # optional – stdlib json is just slower
+    orjson = None
+
+try:
+    from blake3 import blake3 as _new_hasher
+except ImportError:  # optional – sha256 works, just slower on big clips
+    _new_hasher = hashlib.sha256
+
+
+def dumps_pretty(obj) -> str:
+    """Indented JSON for display; orjson when available (C extension,
+    several times faster on big result payloads than json.dumps)."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2).decode()
+    return json.dumps(obj, indent=2)
+
+
+def parse_json(resp):
+    """Parse a requests response body with orjson when available."""
+    if orjson is not None:
+        return orjson.loads(resp.content)
+    return resp.json()
+
+DEFAULT_BACKEND_URL = "http://localhost:8000/analyze_video"
+
+# Videos above this size are uploaded in 8 MB chunks: single huge POSTs
+# are what proxies and load balancers time out or reject.
+CHUNKED_UPLOAD_THRESHOLD = 32 << 20
+CHUNK_SIZE = 8 << 20
+
+
+@st.cache_resource(show_spinner=False)
+def get_session() -> requests.Session:
+    """
+    One keep-alive session shared across the whole Streamlit process.
+    The pooled connections skip a TCP/TLS handshake per call, the
+    built-in retry absorbs transient 5xx from the backend or a proxy
+    instead of bouncing the error to the user, and TCP_NODELAY stops
+    Nagle's algorithm from batching upload chunks.
+
+    Retries cover GET and the offset-keyed chunk PUTs only. POST bodies
+    are not replayable (the MultipartEncoder stream is exhausted after
+    the first send) and a retried analyze/finalize POST that did reach
+    the backend would enqueue a duplicate job.
+    """
+    session = requests.Session()
+    retry = Retry(
+        total=3,
+        backoff_factor=0.5,
+        status_forcelist=[502, 503, 504],
+        allowed_methods=["GET", "PUT"],
+        respect_retry_after_header=True,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=2,
+        pool_maxsize=8,
+        max_retries=retry,
+        socket_options=HTTPConnection.default_socket_options + [
+            (socket.IPPROTO_TCP, socket.TCP_NODELAY, 1),
+            (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1),
+        ],
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def hash_uploaded_video(uploaded_video) -> str:
+    """
+    Content hash of the upload, streamed in 1 MB reads so the file is
+    never duplicated in memory just for hashing (no getvalue()/full
+    read(): memory stays O(chunk), not O(file)). blake3 when installed –
+    it's multi-threaded and several times faster than sha256 on large
+    clips.
+    """
+    h = _new_hasher()
+    uploaded_video.seek(0)
+    for chunk in iter(lambda: uploaded_video.read(1 << 20), b""):
+        h.update(chunk)
+    uploaded_video.seek(0)
+    return h.hexdigest()
+
+
+def upload_in_chunks(base_url: str, uploaded_video, content_sha: str = None):
+    """
+    Upload the video as a series of 8 MB PUTs keyed by a session id and
+    byte offset, then ask the backend to finalize and analyze. A failed
+    chunk is retried with backoff instead of restarting the whole upload.
+    Returns the parsed JSON analysis response, or None on failure.
+    """
+    upload_id = uuid.uuid4().hex
+    total = getattr(uploaded_video, "size", 0) or 0
+    uploaded_video.seek(0)
+    offset = 0
+    progress = st.progress(0.0, text="Uploading…")
+
+    while True:
+        chunk = uploaded_video.read(CHUNK_SIZE)
+        if not chunk:
+            break
+
+        # Retries with backoff live in the session adapter (the
+        # offset-keyed PUT is safe to replay); no second retry loop here,
+        # or an unreachable backend costs attempts-squared per chunk.
+        try:
+            resp = get_session().put(
+                f"{base_url}/upload/{upload_id}/{offset}",
+                data=chunk,
+                headers={
+                    "Content-Range":
+                        f"bytes {offset}-{offset + len(chunk) - 1}/{total}"
+                },
+                timeout=120,
+            )
+            resp.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            progress.empty()
+            st.error(f"Chunk upload failed: {e}")
+            return None
+
+        offset += len(chunk)
+        if total:
+            progress.progress(
+                min(offset / total, 1.0),
+                text=f"Uploading… {offset / (1 << 20):.0f} / {total / (1 << 20):.0f} MB",
+            )
+
+    progress.empty()
+
+    try:
+        headers = {"X-Content-SHA": content_sha} if content_sha else {}
+        resp = get_session().post(
+            f"{base_url}/analyze_video/finalize",
+            json={"upload_id": upload_id, "filename": uploaded_video.name},
+            headers=headers,
+            timeout=(10, 1800),
+        )
+        resp.raise_for_status()
+    except requests.exceptions.RequestException as e:
+        st.error(f"Error calling backend: {e}")
+        return None
+
+    try:
+        return parse_json(resp)
+    except Exception as e:
+        st.error(f"Error parsing backend response as JSON: {e}")
+        return None
+
+
+def call_backend(backend_url: str, uploaded_video, content_sha: str = None):
+    """
+    Send the uploaded video to the FastAPI backend and return JSON response.
+    Streams straight from Streamlit's upload buffer in small chunks instead
+    of materializing the whole file as a second bytes copy in memory.
+    """
+    uploaded_video.seek(0)
+    mime = uploaded_video.type or "video/mp4"
+    headers = {"X-Content-SHA": content_sha} if content_sha else {}
+    try:
+        if MultipartEncoder is not None:
+            encoder = MultipartEncoder(
+                fields={"file": (uploaded_video.name, uploaded_video, mime)}
+            )
+            resp = get_session().post(
+                backend_url,
+                data=encoder,
+                headers={"Content-Type": encoder.content_type, **headers},
+                timeout=(10, 1800),
+            )
+        else:
+            resp = get_session().post(
+                backend_url,
+                files={"file": (uploaded_video.name, uploaded_video, mime)},
+                headers=headers,
+                timeout=(10, 1800),
+            )
+        resp.raise_for_status()
+    except requests.exceptions.RequestException as e:
+        st.error(f"Error calling backend: {e}")
+        return None
+
+    try:
+        return parse_json(resp)
+    except Exception as e:
+        st.error(f"Error parsing backend response as JSON: {e}")
+        return None
+
+
+def wait_for_result(base_url: str, job_id: str):
+    """
+    Poll the backend until the analysis job finishes, surfacing percent
+    done and partial stats in a progress bar, and return the final result
+    payload (same shape the old blocking endpoint returned).
+    """
+    progress = st.progress(0.0, text="Analyzing…")
+
+    while True:
+        try:
+            resp = get_session().get(f"{base_url}/analyze_video/{job_id}", timeout=30)
+            resp.raise_for_status()
+            payload = parse_json(resp)
+        except requests.exceptions.RequestException as e:
+            progress.empty()
+            st.error(f"Error polling analysis job: {e}")
+            return None
+
+        if payload.get("status") in ("done", "error"):
+            progress.empty()
+            return payload.get("result") or payload
+
+        pct = payload.get("pct") or 0.0
+        partial = payload.get("partial") or {}
+        text = "Analyzing…"
+        if partial.get("num_vehicles") is not None:
+            text = f"Analyzing… {partial['num_vehicles']} vehicles so far"
+        progress.progress(min(pct / 100.0, 1.0), text=text)
+        time.sleep(1.5)
+
+
+class AnalysisError(Exception):
+    """A failed analysis. Raised (not returned) from analyze_video_cached
+    so st.cache_data never memoizes a transient failure – exceptions are
+    not cached, so the next click retries against the backend."""
+
+
+@st.cache_data(ttl=3 * 3600, max_entries=32, show_spinner=False)
+def analyze_video_cached(content_sha: str, backend_url: str, _uploaded_video):
+    """
+    Run the analysis, cached by (content hash, backend URL) so re-clicking
+    Run Analysis on the same clip re-displays the stored JSON instantly
+    instead of re-uploading and re-running YOLO. Only successful responses
+    are stored (failures raise AnalysisError and stay out of the cache);
+    the video itself stays out too, and the leading underscore keeps the
+    file object out of the cache key. The hash also goes up as
+    X-Content-SHA so the backend could dedupe too.
+
+    The upload returns a job_id right away and the result is polled, so
+    the backend is never blocked on one multi-minute request.
+    """
+    base_url = backend_url.rsplit("/analyze_video", 1)[0]
+    size = getattr(_uploaded_video, "size", 0) or 0
+    if size > CHUNKED_UPLOAD_THRESHOLD:
+        submitted = upload_in_chunks(base_url, _uploaded_video, content_sha)
+    else:
+        submitted = call_backend(backend_url, _uploaded_video, content_sha)
+
+    if submitted is None:
+        raise AnalysisError("could not reach the backend")
+    if "job_id" not in submitted:
+        # An older backend that still answers synchronously
+        result = submitted
+    else:
+        result = wait_for_result(base_url, submitted["job_id"])
+
+    if result is None:
+        raise AnalysisError("analysis job did not finish")
+    if result.get("status") != "ok":
+        raise AnalysisError(result.get("detail") or f"backend returned: {result}")
+    return result
+
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def decode_b64(s: str) -> bytes:
+    """Base64 decode cached per frame, so reruns reuse the bytes instead
+    of re-decoding every preview on each widget interaction."""
+    return base64.b64decode(s)
+
+
+@st.cache_data(ttl=30, show_spinner=False)
+def probe_backend(base_url: str) -> bool:
+    """
+    Health check cached for 30 s. Probing on every rerun would put a
+    blocking network round-trip in the middle of each widget
+    interaction; this caps it at two probes per minute.
+    """
+    try:
+        return get_session().get(f"{base_url}/health", timeout=2).ok
+    except requests.exceptions.RequestException:
+        return False
+
+
+# st.fragment arrived in Streamlit 1.33; on older versions fall back to a
+# plain function call (whole-script reruns, the old behaviour).
+_fragment = getattr(st, "fragment", lambda f: f)
+
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def rows_to_table(rows):
+    """
+    Row-list to Arrow table conversion, cached by content. Arrow is what
+    st.dataframe ships over the wire anyway, so converting once here
+    avoids both a per-rerun rebuild and a pandas round-trip.
+    """
+    return pa.Table.from_pylist(rows)
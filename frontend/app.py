@@ -1,27 +1,18 @@
 # frontend/app.py
 
-import json
-import requests
 import streamlit as st
 
-DEFAULT_BACKEND_URL = "http://localhost:8000/analyze_video"
-
-
-def call_backend(backend_url: str, video_bytes: bytes, filename: str):
-    """Send video file to FastAPI backend and return JSON response."""
-    files = {"file": (filename, video_bytes, "video/mp4")}
-    try:
-        resp = requests.post(backend_url, files=files, timeout=600)
-        resp.raise_for_status()
-    except requests.exceptions.RequestException as e:
-        st.error(f"Error calling backend: {e}")
-        return None
-
-    try:
-        return resp.json()
-    except Exception as e:
-        st.error(f"Error parsing backend response as JSON: {e}")
-        return None
+from _common import (
+    DEFAULT_BACKEND_URL,
+    AnalysisError,
+    _fragment,
+    analyze_video_cached,
+    decode_b64,
+    dumps_pretty,
+    hash_uploaded_video,
+    probe_backend,
+    rows_to_table,
+)
 
 
 def main():
@@ -40,8 +31,14 @@ def main():
             "Backend /analyze_video URL",
             value=DEFAULT_BACKEND_URL,
             help="Make sure your FastAPI backend is running on this URL.",
+            key="backend_url",
         )
 
+        if probe_backend(backend_url.strip().rsplit("/analyze_video", 1)[0]):
+            st.success("Backend reachable")
+        else:
+            st.warning("Backend unreachable")
+
         st.markdown("---")
         st.header("Instructions")
         st.write(
@@ -54,6 +51,7 @@ def main():
     uploaded_video = st.file_uploader(
         "Upload traffic video (.mp4, .mov, .avi, .mkv)",
         type=["mp4", "mov", "avi", "mkv"],
+        key="video_upload",
     )
 
     if uploaded_video is None:
@@ -63,22 +61,36 @@ def main():
     # Show video preview
     st.video(uploaded_video)
 
-    run_clicked = st.button("Run Analysis")
-
-    if not run_clicked:
+    run_clicked = st.button("Run Analysis", key="run_analysis")
+
+    if run_clicked:
+        try:
+            with st.spinner("Sending video to backend and analyzing..."):
+                content_sha = hash_uploaded_video(uploaded_video)
+                result = analyze_video_cached(
+                    content_sha, backend_url.strip(), uploaded_video
+                )
+            st.session_state["result"] = result
+        except AnalysisError as e:
+            # Not cached – clicking Run Analysis again retries for real.
+            st.error(f"Analysis failed: {e}")
+
+    # Render from session state so the results survive reruns without
+    # re-running the analysis, and stay visible after widget interactions.
+    result = st.session_state.get("result")
+    if result is None:
         return
 
-    with st.spinner("Sending video to backend and analyzing..."):
-        video_bytes = uploaded_video.read()
-        result = call_backend(backend_url.strip(), video_bytes, uploaded_video.name)
+    render_results(result, backend_url.strip())
 
-    if result is None:
-        st.stop()
-
-    if result.get("status") != "ok":
-        st.error(f"Backend returned an error: {result}")
-        st.stop()
 
+@_fragment
+def render_results(result, backend_url):
+    """
+    Result display, isolated in a fragment: interacting with widgets in
+    here (the raw-JSON checkbox) reruns only this block, not the whole
+    script with its upload handling and backend calls.
+    """
     data = result.get("data", {})
 
     summary = data.get("summary_stats", {})
@@ -93,6 +105,12 @@ def main():
         c2.metric("Overspeeding", summary.get("num_overspeed", 0))
         c3.metric("Within limit", summary.get("num_within_limit", 0))
 
+        # Precomputed server-side; nothing is re-reduced here per rerun.
+        c4, c5, c6 = st.columns(3)
+        c4.metric("Min speed (km/h)", summary.get("min_speed_kmh", 0.0))
+        c5.metric("Max speed (km/h)", summary.get("max_speed_kmh", 0.0))
+        c6.metric("Avg speed (km/h)", summary.get("avg_speed_kmh", 0.0))
+
         st.write(
             f"Speed limit: **{summary.get('speed_limit_kmh', 0)} km/h**  "
             f"(grace: **{summary.get('grace_kmh', 0)} km/h**)"
@@ -105,20 +123,52 @@ def main():
     # === Overspeed table ===
     st.subheader("Overspeeding Vehicles")
     if overspeed_events:
-        st.table(overspeed_events)
+        st.dataframe(
+            rows_to_table(overspeed_events),
+            use_container_width=True,
+            height=400,
+        )
     else:
         st.write("No overspeed events detected.")
 
     # === Within-limit table ===
     st.subheader("Within-Limit Vehicles")
     if within_limit:
-        st.table(within_limit)
+        st.dataframe(
+            rows_to_table(within_limit),
+            use_container_width=True,
+            height=400,
+        )
     else:
         st.write("No vehicles within limit or insufficient tracking data.")
 
+    # === Annotated video ===
+    annotated_url = data.get("annotated_video_url")
+    if annotated_url:
+        st.subheader("Annotated Video")
+        # Served straight off the backend's disk; the browser streams and
+        # caches it, so there is no base64 inflation and nothing to
+        # re-decode on reruns.
+        base_url = backend_url.strip().rsplit("/analyze_video", 1)[0]
+        st.video(base_url + annotated_url)
+
+    # === Preview frames ===
+    previews = data.get("preview_frames_b64", [])
+    if previews:
+        with st.expander("Preview Frames", expanded=False):
+            # Expander bodies run server-side even while collapsed, so the
+            # decode is gated behind an explicit toggle; one st.image call
+            # with a list then batches the image transport instead of
+            # pushing one message per frame.
+            if st.checkbox("Show preview frames", key="show_previews"):
+                st.image([decode_b64(f) for f in previews])
+
     # === Raw JSON (debug) ===
     with st.expander("Raw JSON response (debug)"):
-        st.code(json.dumps(result, indent=2), language="json")
+        # Only serialize when asked: dumping thousands of rows on every
+        # rerun just to sit in a collapsed expander is wasted work.
+        if st.checkbox("Show raw JSON", key="show_debug"):
+            st.code(dumps_pretty(result), language="json")
 
 
 if __name__ == "__main__":
@@ -1,7 +1,87 @@
 # hardware/capture_video.py
 
 import cv2
+import os
+import queue
+import threading
 import time
+import uuid
+
+try:
+    import requests
+except ImportError:  # optional – recording works without the upload step
+    requests = None
+
+RECORD_SECONDS = 15
+
+# Set SPEEDCAM_BACKEND_URL (e.g. http://server:8000) to upload the clip
+# for analysis as soon as recording finishes.
+BACKEND_URL = os.environ.get("SPEEDCAM_BACKEND_URL", "")
+UPLOAD_CHUNK = 8 << 20
+
+
+def open_writer(path, fps, size):
+    """
+    Try the hardware H.264 encoder first via a GStreamer pipeline
+    (v4l2h264enc is the Pi's encoder block; dedicated silicon, so the CPU
+    stays free for capture). Fall back to the software mp4v encoder when
+    OpenCV was built without GStreamer or the encoder isn't present.
+    """
+    pipeline = (
+        "appsrc ! videoconvert ! v4l2h264enc ! h264parse ! mp4mux "
+        f"! filesink location={path}"
+    )
+    out = cv2.VideoWriter(pipeline, cv2.CAP_GSTREAMER, 0, fps, size, True)
+    if out.isOpened():
+        return out
+    fourcc = cv2.VideoWriter_fourcc(*"mp4v")
+    return cv2.VideoWriter(path, fourcc, fps, size)
+
+
+def upload_clip(path):
+    """
+    Stream the finished clip to the backend's chunked-upload endpoints
+    in 8 MB reads: one pass over the file, never a full copy in memory,
+    and a failed chunk retries without restarting the upload. Uploading
+    can't overlap recording because mp4mux only writes the moov atom
+    when the file is finalized, so this starts the moment out.release()
+    returns.
+    """
+    if not BACKEND_URL or requests is None:
+        return
+    upload_id = uuid.uuid4().hex
+    offset = 0
+    try:
+        with open(path, "rb") as f:
+            while True:
+                chunk = f.read(UPLOAD_CHUNK)
+                if not chunk:
+                    break
+                # Retry each chunk with backoff before giving up; the
+                # offset-keyed PUT is safe to replay.
+                for attempt in range(3):
+                    try:
+                        requests.put(
+                            f"{BACKEND_URL}/upload/{upload_id}/{offset}",
+                            data=chunk,
+                            timeout=120,
+                        ).raise_for_status()
+                        break
+                    except requests.exceptions.RequestException:
+                        if attempt == 2:
+                            raise
+                        time.sleep(0.5 * 2 ** attempt)
+                offset += len(chunk)
+        resp = requests.post(
+            f"{BACKEND_URL}/analyze_video/finalize",
+            json={"upload_id": upload_id, "filename": path},
+            timeout=30,
+        )
+        resp.raise_for_status()
+        print(f"📤 Uploaded for analysis: job {resp.json().get('job_id')}")
+    except requests.exceptions.RequestException as e:
+        print(f"❌ Upload failed: {e}")
+
 
 def main():
     # 0 = default USB camera. For Pi camera, this might be 0 or 1 depending on setup.
@@ -11,7 +91,17 @@ def main():
         print("❌ Could not open camera. Check connection / index.")
         return
 
-    # Read one frame to get resolution
+    # MJPG capture: the default YUYV streams uncompressed frames at ~3×
+    # the USB bandwidth and caps FPS well below 30 at 720p. Request an
+    # explicit mode and a 1-frame driver buffer so frames are always
+    # fresh rather than queued.
+    cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*"MJPG"))
+    cap.set(cv2.CAP_PROP_FRAME_WIDTH, 1280)
+    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 720)
+    cap.set(cv2.CAP_PROP_FPS, 30)
+    cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+
+    # Read one frame to get the resolution the camera actually granted
     ret, frame = cap.read()
     if not ret:
         print("❌ Could not read frame from camera.")
@@ -20,35 +110,55 @@ def main():
 
     height, width = frame.shape[:2]
 
-    # Define output video
-    fourcc = cv2.VideoWriter_fourcc(*"mp4v")
-    out = cv2.VideoWriter("edge_clip.mp4", fourcc, 30.0, (width, height))
+    out = open_writer("edge_clip.mp4", 30.0, (width, height))
 
-    print("🎥 Recording started. Press 'q' to stop or wait 15 seconds...")
+    # No cv2.imshow/waitKey in the loop: the X11 blit plus the forced 1 ms
+    # wait per frame were costing more than the encode itself and dropped
+    # frames on the Pi. Ctrl+C stops early.
+    print(f"🎥 Recording for {RECORD_SECONDS} seconds (Ctrl+C to stop early)...")
 
-    start = time.time()
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            print("❌ Failed to grab frame.")
-            break
+    # Encode + disk write run on their own thread so the capture loop
+    # never stalls behind a slow flush; a shallow queue bounds memory and
+    # a full queue drops the frame instead of blocking capture.
+    frames = queue.Queue(maxsize=4)
 
-        out.write(frame)
-        cv2.imshow("Recording - press q to stop", frame)
+    def writer():
+        while True:
+            f = frames.get()
+            if f is None:
+                break
+            out.write(f)
 
-        # Stop after ~15 seconds OR if user presses 'q'
-        if (time.time() - start) > 15:
-            print("⏱ 15 seconds reached, stopping.")
-            break
+    writer_thread = threading.Thread(target=writer, daemon=True)
+    writer_thread.start()
 
-        if cv2.waitKey(1) & 0xFF == ord("q"):
-            print("🛑 'q' pressed, stopping.")
-            break
+    # grab()/retrieve() into the preallocated frame buffer: retrieve
+    # decodes in place, so the loop allocates no fresh ndarray per frame.
+    # The copy on enqueue is required because retrieve reuses that buffer.
+    deadline = time.monotonic() + RECORD_SECONDS
+    try:
+        while time.monotonic() < deadline:
+            ret = cap.grab()
+            if ret:
+                ret, frame = cap.retrieve(frame)
+            if not ret:
+                print("❌ Failed to grab frame.")
+                break
+            try:
+                frames.put_nowait(frame.copy())
+            except queue.Full:
+                pass  # drop the frame rather than stall capture
+        else:
+            print(f"⏱ {RECORD_SECONDS} seconds reached, stopping.")
+    except KeyboardInterrupt:
+        print("🛑 Interrupted, stopping.")
 
+    frames.put(None)  # sentinel: flush remaining frames, then stop
+    writer_thread.join()
     cap.release()
     out.release()
-    cv2.destroyAllWindows()
     print("✅ Saved video as edge_clip.mp4 in this folder.")
+    upload_clip("edge_clip.mp4")
 
 if __name__ == "__main__":
     main()